@@ -1,34 +1,40 @@
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-# from langgraph.checkpoint.postgres import PostgresSaver  # For production
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+# from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver  # For multi-process deployments
+import aiosqlite
 
-from .shared_state import DiagnosticState
+from .shared_state import DiagnosticState, SymptomAnalysis
 from .symptom_parser_agent import SymptomParserAgent
 from .web_research_agent import WebResearchAgent
-
-from langchain_groq import ChatGroq
+from .llm import get_llm
 
 import os
+from typing import Optional
 from dotenv import load_dotenv, find_dotenv
 
 _ = load_dotenv(find_dotenv())
 
+# Steps that need the large model, everything else runs on the fast one
+DEEP_MODEL_TASKS = {'research_synthesis'}
+
 class AgentGraph():
-    def __init__(self, model_name):
-        model = ChatGroq(model=model_name, temperature=0.1, api_key=os.getenv('GROQ_API_KEY'))
-        self.system_parser_agent = SymptomParserAgent(model=model)
-        self.web_researcher_agent = WebResearchAgent(model=model)
+    def __init__(self, model_name_fast, model_name_deep, checkpoint_db=os.getenv('DIAGNOSTICAI_CHECKPOINT_DB', 'checkpoints.db')):
+        self.model_name_fast = model_name_fast
+        self.model_name_deep = model_name_deep
 
-        graph = StateGraph(DiagnosticState)
+        self.system_parser_agent = SymptomParserAgent(model=self.model_for_task('symptom_parsing'))
+        self.web_researcher_agent = WebResearchAgent(
+            model=self.model_for_task('tool_orchestration'),
+            synthesis_model=self.model_for_task('research_synthesis')
+        )
 
-        graph.set_entry_point('router')
+        graph = StateGraph(DiagnosticState)
 
-        graph.add_node('router', lambda state: state)
         graph.add_node('symptom_parser', self.system_parser_agent.process)
         graph.add_node('web_researcher', self.web_researcher_agent.process)
 
-        graph.add_conditional_edges(
-            'router', 
+        # Route straight from START, no pass-through node (and checkpoint) needed
+        graph.set_conditional_entry_point(
             self.route_from_entry,
             {
                 'symptom_parser': 'symptom_parser', 
@@ -44,8 +50,31 @@ class AgentGraph():
         
         graph.add_edge('web_researcher', END)
 
-        checkpointer = MemorySaver()
-        self.agent_graph = graph.compile(checkpointer=checkpointer)
+        # AsyncSqliteSaver needs a running event loop, so the checkpointer is created
+        # and the graph compiled in setup(), which must be awaited before use
+        self.graph = graph
+        self.checkpoint_db = checkpoint_db
+        self.checkpoint_conn = None
+        self.checkpointer = None
+        self.agent_graph = None
+
+    def model_for_task(self, task: str):
+        """Pick the model for a chain step: the deep model only where synthesis quality matters"""
+        return get_llm(self.model_name_deep if task in DEEP_MODEL_TASKS else self.model_name_fast)
+
+    async def setup(self):
+        """Open the checkpoint store, compile the graph, and tune SQLite for frequent small writes"""
+        self.checkpoint_conn = await aiosqlite.connect(self.checkpoint_db)
+        self.checkpointer = AsyncSqliteSaver(self.checkpoint_conn)
+        await self.checkpointer.setup()
+        await self.checkpoint_conn.execute("PRAGMA journal_mode=WAL")
+        await self.checkpoint_conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.agent_graph = self.graph.compile(checkpointer=self.checkpointer)
+
+    async def aclose(self):
+        if self.checkpoint_conn is not None:
+            await self.checkpoint_conn.close()
 
     def route_from_entry(self, state: DiagnosticState):
         """Decide where to go from entry point"""
@@ -59,38 +88,20 @@ class AgentGraph():
             return 'symptom_parser'
         
     def check_all_data_extracted(self, state: DiagnosticState):
-        if not state.symptom_analysis:
+        return self.extraction_route(state.symptom_analysis, state.interaction_count)
+
+    def check_values_extracted(self, values: dict):
+        """check_all_data_extracted for the plain state values returned by ainvoke/aget_state"""
+        return self.extraction_route(values.get('symptom_analysis'), values.get('interaction_count', 0))
+
+    def extraction_route(self, analysis: Optional[SymptomAnalysis], interaction_count: int):
+        if not analysis:
             return 'continue'
-        
-        analysis = state.symptom_analysis
-        
-        required_fields = [
-            analysis.parsed_symptoms,
-            analysis.body_parts_affected, 
-            analysis.time_since_start,
-            analysis.evolution_of_symptoms,
-            analysis.medical_checks
-        ]
-
-        all_data_complete = True
-        
-        for field in required_fields:
-            if field is None:
-                all_data_complete = False
-                break
-            
-            if isinstance(field, list) and len(field) == 0:
-                all_data_complete = False
-                break
-                
-            if isinstance(field, str) and not field.strip():
-                all_data_complete = False
-                break
-
-        if all_data_complete or state.interaction_count >= 5:
+
+        if analysis.is_complete() or interaction_count >= 5:
             return 'continue_to_web_research'
 
         if analysis.follow_up_questions and len(analysis.follow_up_questions) > 0:
             return 'ask_user'
         
-        return 'continue'
\ No newline at end of file
+        return 'continue'
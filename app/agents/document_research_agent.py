@@ -2,18 +2,125 @@ from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.tools import BaseTool, StructuredTool, Tool, tool
 from langchain_core.prompts import HumanMessagePromptTemplate, SystemMessagePromptTemplate, ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-from langchain_groq import ChatGroq
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+from langchain_community.document_loaders import PyPDFLoader, PyMuPDFLoader
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from .shared_state import DiagnosticState, DocumentResearchAgentInformation
+from .llm import get_llm
 import os
+import asyncio
+import atexit
+import hashlib
+import json
+import multiprocessing
+import queue
+import shelve
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+import faiss
+import numpy as np
+
+# Below this many chunks PQ training is unreliable and HNSW is used instead
+PQ_MIN_VECTORS = 10000
+PQ_SUBQUANTIZERS = 16
+PQ_TRAINING_SAMPLE = 50000
+
+QUERY_EMBEDDING_CACHE_PATH = "./.embedding_cache/query_embeddings"
+FAISS_CACHE_DIR = "./.faiss_cache"
+EMBED_BATCH_SIZE = 256
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 200
+
+# query -> retrieval task, scoped to a single DocumentResearchAgent.process call
+_request_documents: ContextVar[Optional[dict]] = ContextVar('request_documents', default=None)
+
+
+def _load_pdf_with_pymupdf(path: str):
+    """All pages of one PDF. Module-level so it can run in a worker process"""
+    return PyMuPDFLoader(path).load()
+
+def _sources(docs, default: str):
+    """Distinct document sources in retrieval order (dict.fromkeys dedups in one pass)"""
+    return list(dict.fromkeys(doc.metadata.get('source', default) for doc in docs))
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wrap an embeddings model so repeated queries skip the embedding API call"""
+
+    def __init__(self, embeddings, cache_path=QUERY_EMBEDDING_CACHE_PATH, maxsize=1024):
+        self.embeddings = embeddings
+        # Part of the cache key, vectors from another model must never be served
+        self.model_name = getattr(embeddings, 'model', type(embeddings).__name__)
+        self.maxsize = maxsize
+        self.memory_cache = OrderedDict()
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.disk_cache = shelve.open(cache_path)
+        # The async methods reach the shelf from worker threads
+        self.disk_lock = threading.Lock()
+        atexit.register(self.disk_cache.close)
+
+    def _read_disk(self, key):
+        with self.disk_lock:
+            return self.disk_cache.get(key)
+
+    def _write_disk(self, key, vector):
+        with self.disk_lock:
+            self.disk_cache[key] = vector
+
+    def _remember(self, key, vector):
+        self.memory_cache[key] = vector
+        self.memory_cache.move_to_end(key)
+        if len(self.memory_cache) > self.maxsize:
+            self.memory_cache.popitem(last=False)
+
+    def _cache_key(self, text):
+        return hashlib.blake2b(f"{self.model_name}\n{text}".encode()).hexdigest()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text):
+        key = self._cache_key(text)
+        vector = self.memory_cache.get(key)
+        if vector is None:
+            vector = self._read_disk(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._write_disk(key, vector)
+        self._remember(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        # Same as embed_query, with the shelf I/O kept off the event loop
+        key = self._cache_key(text)
+        vector = self.memory_cache.get(key)
+        if vector is None:
+            vector = await asyncio.to_thread(self._read_disk, key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._write_disk, key, vector)
+        self._remember(key, vector)
+        return vector
 
 class DocumentResearchAgent:
     def __init__(self, model=None, pdf_directory="./medical_pdfs"):
-        self.model = model or ChatGroq(model='llama-3.1-8b', temperature=0.01)
+        self.model = model or get_llm('llama-3.1-8b', temperature=0.01)
         self.parser = PydanticOutputParser(pydantic_object=DocumentResearchAgentInformation)
+        self._format_instructions = self.parser.get_format_instructions()
         self.pdf_directory = pdf_directory
         
         self.knowledge_base = None
@@ -21,6 +128,7 @@ class DocumentResearchAgent:
         self._initialize_rag_system()
         
         self.tools = self._create_rag_tools()
+        self.rag_tools = {rag_tool.name: rag_tool for rag_tool in self.tools}
 
         system_message = SystemMessagePromptTemplate.from_template("""
             You are a medical document research agent that searches through medical literature and documents.
@@ -64,7 +172,7 @@ class DocumentResearchAgent:
         self.prompt = ChatPromptTemplate.from_messages([
             system_message, 
             human_message
-        ])
+        ]).partial(format_instructions=self._format_instructions)
 
         self.agent = create_tool_calling_agent(
             llm=self.model,
@@ -72,6 +180,35 @@ class DocumentResearchAgent:
             prompt=self.prompt
         )
 
+        synthesis_human_message = HumanMessagePromptTemplate.from_template("""
+            Please research the following medical case. The medical documents have already
+            been searched for you, use the excerpts below instead of calling tools:
+            
+            Primary symptoms to research: {symptoms}
+            
+            Additional context:
+            - Affected body parts: {body_parts}
+            - Symptom timeline: {timeline}
+            - How symptoms evolved: {evolution}
+            - Previous medical care: {medical_checks}
+            
+            Document search results:
+            {search_results}
+            
+            Condition information:
+            {condition_information}
+            
+            Warning signs:
+            {warning_signs}
+            
+            Provide comprehensive findings from medical literature.
+        """)
+
+        self.synthesis_chain = ChatPromptTemplate.from_messages([
+            system_message,
+            synthesis_human_message
+        ]).partial(format_instructions=self._format_instructions) | self.model
+
         self.executor = AgentExecutor(
             agent=self.agent,
             tools=self.tools,
@@ -88,32 +225,34 @@ class DocumentResearchAgent:
                 os.makedirs(self.pdf_directory)
                 print(f"Created {self.pdf_directory}. Add your medical PDF files there.")
                 return
-            
-            loader = DirectoryLoader(
-                self.pdf_directory,
-                glob="**/*.pdf",
-                loader_cls=PyPDFLoader
-            )
-            documents = loader.load()
-            
-            if not documents:
+
+            pdf_paths = sorted(Path(self.pdf_directory).glob("**/*.pdf"))
+            if not pdf_paths:
                 print("No PDF files found. Add medical PDFs to process.")
                 return
+
+            # Large request batches keep the number of embedding API round trips low
+            base_embeddings = OpenAIEmbeddings(chunk_size=512, max_retries=3)
+            embeddings = CachedQueryEmbeddings(base_embeddings)
+
+            # The index is keyed by the PDF contents and everything that shapes it, so a
+            # change to the corpus, embedding model, chunking or index type triggers a rebuild
+            cache_path = os.path.join(FAISS_CACHE_DIR, self._corpus_hash(pdf_paths, base_embeddings.model))
+
+            self.knowledge_base = self._load_cached_knowledge_base(cache_path, embeddings)
+            if self.knowledge_base is None:
+                self.knowledge_base = self._build_knowledge_base(embeddings, pdf_paths)
+                if self.knowledge_base is None:
+                    return
+                self._save_knowledge_base(cache_path)
+
+            if os.getenv('DIAGNOSTICAI_USE_GPU_FAISS') == '1':
+                self._move_index_to_gpu()
             
-            print(f"Loaded {len(documents)} document pages from PDFs")
-            
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            texts = text_splitter.split_documents(documents)
-            print(f"Split into {len(texts)} text chunks")
-            
-            embeddings = OpenAIEmbeddings()
-            self.knowledge_base = FAISS.from_documents(texts, embeddings)
-            
+            # MMR re-ranks a wider candidate set so near-duplicate chunks don't fill all 5 slots
             self.retriever = self.knowledge_base.as_retriever(
-                search_kwargs={"k": 5}
+                search_type="mmr",
+                search_kwargs={"k": 5, "fetch_k": 20, "lambda_mult": 0.5}
             )
             
             print("RAG system initialized successfully!")
@@ -123,6 +262,262 @@ class DocumentResearchAgent:
             self.knowledge_base = None
             self.retriever = None
 
+    def _load_cached_knowledge_base(self, cache_path, embeddings):
+        """Saved FAISS store for this corpus, or None when there is none or it cannot be read"""
+        if not os.path.exists(cache_path):
+            return None
+
+        try:
+            knowledge_base = FAISS.load_local(
+                cache_path,
+                embeddings,
+                allow_dangerous_deserialization=True
+            )
+        except Exception as e:
+            print(f"Could not load FAISS index from {cache_path}, rebuilding: {e}")
+            return None
+
+        self._set_search_params(knowledge_base.index)
+        print(f"Loaded FAISS index from {cache_path}")
+        return knowledge_base
+
+    def _save_knowledge_base(self, cache_path):
+        """Save into a temporary directory and move it into place, so an interrupted save leaves no partial index"""
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        try:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            self.knowledge_base.save_local(tmp_path)
+
+            # Unreadable leftovers from an older run are replaced
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.replace(tmp_path, cache_path)
+            print(f"Saved FAISS index to {cache_path}")
+        except Exception as e:
+            # The index in memory is still usable, it is just rebuilt on the next start
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            print(f"Could not save FAISS index to {cache_path}: {e}")
+
+    def _corpus_hash(self, pdf_paths, embedding_model):
+        """Hash of the PDF file names and contents, plus the settings the index is built with"""
+        digest = hashlib.blake2b()
+        digest.update(json.dumps({
+            'embedding_model': embedding_model,
+            'chunk_size': CHUNK_SIZE,
+            'chunk_overlap': CHUNK_OVERLAP,
+            'hnsw_neighbors': HNSW_NEIGHBORS,
+            'hnsw_ef_construction': HNSW_EF_CONSTRUCTION,
+            'pq_min_vectors': PQ_MIN_VECTORS,
+            'pq_subquantizers': PQ_SUBQUANTIZERS,
+            'pq_training_sample': PQ_TRAINING_SAMPLE
+        }, sort_keys=True).encode())
+        for path in pdf_paths:
+            digest.update(str(path.relative_to(self.pdf_directory)).encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _build_knowledge_base(self, embeddings, pdf_paths):
+        """
+        Load, split and embed the PDFs into a new FAISS store.
+
+        The three stages run as a pipeline connected by bounded queues: loader processes
+        (threads for PyPDF) push pages, a splitter thread turns them into chunks, and this thread embeds
+        the chunks in batches, so PDF extraction and splitting overlap the embedding calls.
+        """
+        # PyMuPDF is much faster; DIAGNOSTICAI_USE_PYPDF=1 switches back for PDFs it rejects
+        loader_cls = PyPDFLoader if os.getenv('DIAGNOSTICAI_USE_PYPDF') == '1' else PyMuPDFLoader
+
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+
+        pages = queue.Queue(maxsize=64)
+        chunks = queue.Queue(maxsize=EMBED_BATCH_SIZE * 2)
+        cancelled = threading.Event()
+
+        # put/take give up once the pipeline is cancelled, so no stage blocks forever on a dead neighbour
+        def put(q, item):
+            while not cancelled.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def take(q):
+            while not cancelled.is_set():
+                try:
+                    return q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            return None
+
+        def load_pdf(path):
+            for page in loader_cls(str(path)).lazy_load():
+                if cancelled.is_set():
+                    return
+                put(pages, page)
+
+        def load_pdfs_in_processes():
+            # PyMuPDF is not safe to use from several threads, so fan out over processes,
+            # one whole file per task
+            # spawn, not fork: other threads (the splitter, the event loop) are running here
+            pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 8,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            try:
+                for file_pages in pool.map(_load_pdf_with_pymupdf, map(str, pdf_paths)):
+                    for page in file_pages:
+                        if cancelled.is_set():
+                            return
+                        put(pages, page)
+            finally:
+                pool.shutdown(cancel_futures=True)
+
+        def load_pdfs():
+            try:
+                if loader_cls is PyMuPDFLoader:
+                    load_pdfs_in_processes()
+                else:
+                    with ThreadPoolExecutor(max_workers=os.cpu_count() or 8) as pool:
+                        list(pool.map(load_pdf, pdf_paths))
+            finally:
+                put(pages, None)
+
+        def split_pages():
+            try:
+                while (page := take(pages)) is not None:
+                    for chunk in text_splitter.split_documents([page]):
+                        put(chunks, chunk)
+            finally:
+                put(chunks, None)
+
+        texts = []
+        vector_batches = []
+
+        def embed_batch(batch):
+            vector_batches.append(embeddings.embed_documents([t.page_content for t in batch]))
+            texts.extend(batch)
+
+        with ThreadPoolExecutor(max_workers=2) as stages:
+            loading = stages.submit(load_pdfs)
+            splitting = stages.submit(split_pages)
+
+            try:
+                batch = []
+                while (chunk := chunks.get()) is not None:
+                    batch.append(chunk)
+                    if len(batch) == EMBED_BATCH_SIZE:
+                        embed_batch(batch)
+                        batch = []
+                if batch:
+                    embed_batch(batch)
+            finally:
+                cancelled.set()
+
+            loading.result()
+            splitting.result()
+
+        if not texts:
+            print("No text could be extracted from the PDFs.")
+            return None
+
+        print(f"Embedded {len(texts)} text chunks from {len(pdf_paths)} PDFs")
+
+        texts_str = [t.page_content for t in texts]
+        vectors = np.asarray(
+            [vector for vector_batch in vector_batches for vector in vector_batch],
+            dtype='float32'
+        )
+
+        faiss_index = self._build_faiss_index(vectors)
+
+        knowledge_base = FAISS(
+            embedding_function=embeddings,
+            index=faiss_index,
+            docstore=InMemoryDocstore({}),
+            index_to_docstore_id={}
+        )
+        knowledge_base.add_embeddings(
+            text_embeddings=zip(texts_str, vectors.tolist()),
+            metadatas=[t.metadata for t in texts]
+        )
+
+        flat_bytes = vectors.shape[0] * vectors.shape[1] * 4
+        index_bytes = faiss.serialize_index(faiss_index).nbytes
+        print(f"FAISS index size: {index_bytes / 1e6:.1f}MB (FP32 flat would be {flat_bytes / 1e6:.1f}MB)")
+
+        return knowledge_base
+
+    def _build_faiss_index(self, vectors):
+        """Pick an ANN index for the corpus size and train it if needed"""
+        num_vectors, dim = vectors.shape
+
+        if num_vectors < PQ_MIN_VECTORS or dim % PQ_SUBQUANTIZERS != 0:
+            # HNSW graph instead of the default brute-force IndexFlatL2 scan
+            index = faiss.IndexHNSWFlat(dim, HNSW_NEIGHBORS)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            self._set_search_params(index)
+            return index
+
+        # Large corpora: store 8-bit PQ codes instead of FP32 vectors
+        nlist = int(np.sqrt(num_vectors))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_SUBQUANTIZERS, 8)
+
+        sample_size = min(num_vectors, PQ_TRAINING_SAMPLE)
+        sample = vectors[np.random.choice(num_vectors, sample_size, replace=False)]
+        index.train(sample)
+        self._set_search_params(index)
+        # MMR re-ranking reconstructs candidate vectors by id
+        index.make_direct_map()
+        return index
+
+    def _set_search_params(self, index):
+        """Query-time accuracy/speed knobs, reapplied after loading an index from disk"""
+        if isinstance(index, faiss.IndexHNSWFlat):
+            index.hnsw.efSearch = 64
+        elif isinstance(index, faiss.IndexIVFPQ):
+            index.nprobe = 10
+
+    def _move_index_to_gpu(self):
+        """Replace the knowledge base index with a GPU copy when faiss-gpu and CUDA are available"""
+        if not hasattr(faiss, 'get_num_gpus') or faiss.get_num_gpus() == 0:
+            print("DIAGNOSTICAI_USE_GPU_FAISS is set but no GPU is available, keeping the CPU index")
+            return
+
+        try:
+            self.knowledge_base.index = faiss.index_cpu_to_all_gpus(self.knowledge_base.index)
+            print(f"FAISS index moved to {faiss.get_num_gpus()} GPU(s)")
+        except Exception as e:
+            # e.g. HNSW indexes have no GPU implementation
+            print(f"Could not move FAISS index to GPU, keeping the CPU index: {e}")
+
+    async def _retrieve(self, query: str):
+        """
+        Retriever lookup memoized per process() call. The tools often search the
+        same text (e.g. the joined symptoms), and the result only depends on the query.
+        """
+        cache = _request_documents.get()
+        if cache is None:
+            return await self.retriever.aget_relevant_documents(query)
+
+        # Store the task itself so concurrent callers with the same query share one lookup
+        task = cache.get(query)
+        if task is None:
+            task = cache[query] = asyncio.ensure_future(self.retriever.aget_relevant_documents(query))
+
+        try:
+            return await task
+        except Exception:
+            # Forget the failure so a retry (e.g. from the executor fallback) runs the lookup again
+            if cache.get(query) is task:
+                del cache[query]
+            raise
+
     def _create_rag_tools(self):
         """Create RAG-based tools for document research"""
         
@@ -145,16 +540,10 @@ class DocumentResearchAgent:
                 }
             
             try:
-                docs = await self.retriever.aget_relevant_documents(query)
+                docs = await self._retrieve(query)
                 
-                results = []
-                sources = []
-                
-                for doc in docs:
-                    results.append(doc.page_content[:500]) 
-                    source = doc.metadata.get('source', 'Unknown source')
-                    if source not in sources:
-                        sources.append(source)
+                results = [doc.page_content[:500] for doc in docs]
+                sources = _sources(docs, 'Unknown source')
                 
                 return {
                     'results': results,
@@ -189,16 +578,10 @@ class DocumentResearchAgent:
             
             try:
                 query = f"diagnosis treatment {conditions}"
-                docs = await self.retriever.aget_relevant_documents(query)
-                
-                information = []
-                sources = []
+                docs = await self._retrieve(query)
                 
-                for doc in docs:
-                    information.append(doc.page_content[:400])
-                    source = doc.metadata.get('source', 'Unknown')
-                    if source not in sources:
-                        sources.append(source)
+                information = [doc.page_content[:400] for doc in docs]
+                sources = _sources(docs, 'Unknown')
                 
                 return {
                     'information': information,
@@ -231,16 +614,10 @@ class DocumentResearchAgent:
             
             try:
                 query = f"warning signs red flags emergency {symptoms}"
-                docs = await self.retriever.aget_relevant_documents(query)
+                docs = await self._retrieve(query)
                 
-                warnings = []
-                sources = []
-                
-                for doc in docs:
-                    warnings.append(doc.page_content[:300])
-                    source = doc.metadata.get('source', 'Unknown')
-                    if source not in sources:
-                        sources.append(source)
+                warnings = [doc.page_content[:300] for doc in docs]
+                sources = _sources(docs, 'Unknown')
                 
                 return {
                     'warnings': warnings,
@@ -267,13 +644,47 @@ class DocumentResearchAgent:
             
             return [placeholder_search]
 
+    async def _stream_synthesis(self, inputs: dict) -> DocumentResearchAgentInformation:
+        """
+        Stream the synthesis answer and stop reading as soon as a complete JSON
+        object with every required field has arrived, instead of waiting for any
+        trailing text the model adds after it.
+        """
+        text = ""
+        async for chunk in self.synthesis_chain.astream(inputs):
+            text += chunk.content
+            if '}' not in chunk.content:
+                continue
+
+            result = self._parse_complete_json(text)
+            if result is not None:
+                return result
+
+        return self.parser.parse(text)
+
+    def _parse_complete_json(self, text: str):
+        """Return the parsed result if text already holds a complete JSON object, else None"""
+        start = text.find('{')
+        if start == -1:
+            return None
+
+        try:
+            data, _ = json.JSONDecoder().raw_decode(text, start)
+        except json.JSONDecodeError:
+            return None
+
+        if not isinstance(data, dict) or not all(field in data for field in DocumentResearchAgentInformation.model_fields):
+            return None
+
+        return DocumentResearchAgentInformation.model_validate(data)
+
     async def process(self, state: DiagnosticState) -> dict:
         """
         Process the diagnostic state and return document research results.
         """
+        # Retrievals are memoized for this call only, see _retrieve
+        request_cache_token = _request_documents.set({})
         try:
-            format_instructions = self.parser.get_format_instructions()
-            
             if state.symptom_analysis:
                 symptoms = state.symptom_analysis.parsed_symptoms or []
                 body_parts = state.symptom_analysis.body_parts_affected or []
@@ -292,14 +703,35 @@ class DocumentResearchAgent:
             evolution_str = ", ".join(evolution) if evolution else "Not specified"
             medical_checks_str = ", ".join(medical_checks) if medical_checks else "None"
 
-            response = await self.executor.ainvoke({
-                'format_instructions': format_instructions,
+            inputs = {
                 'symptoms': symptoms_str,
                 'body_parts': body_parts_str,
                 'timeline': timeline,
                 'evolution': evolution_str,
                 'medical_checks': medical_checks_str
-            })
+            }
+
+            if self.retriever:
+                # The three lookups are independent, run them together and skip the tool-calling loop
+                search, conditions, warnings = await asyncio.gather(
+                    self.rag_tools['search_medical_documents'].ainvoke({'query': symptoms_str}),
+                    self.rag_tools['lookup_medical_conditions'].ainvoke({'conditions': symptoms_str}),
+                    self.rag_tools['find_warning_signs'].ainvoke({'symptoms': symptoms_str})
+                )
+
+                if all(result['status'] == 'success' for result in (search, conditions, warnings)):
+                    parsed_result = await self._stream_synthesis({
+                        **inputs,
+                        'search_results': "\n\n".join(search['results']),
+                        'condition_information': "\n\n".join(conditions['information']),
+                        'warning_signs': "\n\n".join(warnings['warnings'])
+                    })
+
+                    return {
+                        'document_research_information': parsed_result
+                    }
+
+            response = await self.executor.ainvoke(inputs)
 
             parsed_result = self.parser.parse(response['output'])
             
@@ -321,4 +753,7 @@ class DocumentResearchAgent:
             
             return {
                 'document_research_information': error_result
-            }
\ No newline at end of file
+            }
+
+        finally:
+            _request_documents.reset(request_cache_token)
\ No newline at end of file
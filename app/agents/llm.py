@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+from langchain_groq import ChatGroq
+import httpx
+
+import os
+from dotenv import load_dotenv, find_dotenv
+
+_ = load_dotenv(find_dotenv())
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide async HTTP client, so every LLM call reuses pooled keep-alive connections"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+
+@lru_cache(maxsize=None)
+def get_llm(model_name: str, temperature: float = 0.1) -> ChatGroq:
+    """Return the shared ChatGroq client for this model/temperature"""
+    return ChatGroq(
+        model=model_name,
+        temperature=temperature,
+        api_key=os.getenv('GROQ_API_KEY'),
+        http_async_client=get_http_client()
+    )
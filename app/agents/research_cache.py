@@ -0,0 +1,234 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TOOL_CACHE_DB = os.getenv('DIAGNOSTICAI_TOOL_CACHE_DB', 'tool_cache.db')
+TOOL_CACHE_TTL_SECONDS = 24 * 60 * 60
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+SEMANTIC_CACHE_MAX_BUCKETS = 1024
+SEMANTIC_CACHE_TTL_SECONDS = TOOL_CACHE_TTL_SECONDS
+
+def _normalize(value):
+    """Canonical form of a tool argument: trimmed lowercase strings, sorted lists"""
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, (list, tuple)):
+        return sorted(_normalize(item) for item in value)
+    return value
+
+def cache_key(tool_name: str, arguments: dict) -> str:
+    payload = json.dumps(
+        {'tool': tool_name, 'args': {name: _normalize(value) for name, value in arguments.items()}},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ToolResultCache:
+    """
+    Exact-match cache of tool outputs, stored in SQLite so it survives restarts.
+    Entries expire after `ttl` seconds, search results (and MedlinePlus topics) go stale.
+    """
+
+    def __init__(self, path: str, ttl: float = TOOL_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        # One connection shared by the worker threads of aget/aset, serialized by the lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tool_cache)")]
+        if columns and 'created_at' not in columns:
+            # Table from before entries expired, nothing in it can be dated
+            self.conn.execute("DROP TABLE tool_cache")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tool_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.conn.execute("DELETE FROM tool_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM tool_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tool_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self.conn.commit()
+
+    async def aget(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: dict):
+        await asyncio.to_thread(self.set, key, value)
+
+tool_cache = ToolResultCache(TOOL_CACHE_DB)
+
+# Tool calls currently running, keyed like tool_cache, so concurrent identical calls share one run
+_INFLIGHT: Dict[str, asyncio.Task] = {}
+
+async def _run_and_cache(key: str, fn, args, kwargs):
+    result = await fn(*args, **kwargs)
+    if result.get('status') == 'success':
+        await tool_cache.aset(key, result)
+    return result
+
+def _finish_inflight(key: str, task: asyncio.Task):
+    if _INFLIGHT.get(key) is task:
+        del _INFLIGHT[key]
+    # Mark a failure retrieved, every caller may have gone away before it finished
+    if not task.cancelled():
+        task.exception()
+
+def cached_tool(fn):
+    """
+    Serve repeated calls with the same normalized arguments from tool_cache.
+    Only successful results are stored, so failed searches are retried next time.
+    A call that matches one already running waits for that run instead of starting its own.
+    Apply below @tool so the tool keeps the wrapped function's name, docstring and signature.
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(fn.__name__, bound.arguments)
+
+        cached = await tool_cache.aget(key)
+        if cached is not None:
+            return cached
+
+        task = _INFLIGHT.get(key)
+        if task is None:
+            task = asyncio.create_task(_run_and_cache(key, fn, args, kwargs))
+            _INFLIGHT[key] = task
+            task.add_done_callback(functools.partial(_finish_inflight, key))
+
+        # Every caller (the first included) waits through shield, so one caller going
+        # away, e.g. a disconnected client, does not cancel the run the others share
+        return await asyncio.shield(task)
+
+    return wrapper
+
+class SemanticResearchCache:
+    """
+    Nearest-neighbour cache of full research results keyed by the symptom list, so
+    "fever and headache" and "headache, fever" share an entry. The rest of the case
+    (body parts, timeline, evolution, medical checks, earlier findings) and the research
+    iteration must match exactly, so a result is only reused for the same case.
+    Cases are evicted least recently used first beyond `max_buckets`, and expire after `ttl`.
+    Disabled when sentence-transformers or faiss is not installed, or the model cannot be loaded.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        model_name: str = SEMANTIC_CACHE_MODEL,
+        max_buckets: int = SEMANTIC_CACHE_MAX_BUCKETS,
+        ttl: float = SEMANTIC_CACHE_TTL_SECONDS
+    ):
+        self.threshold = threshold
+        self.model_name = model_name
+        self.max_buckets = max_buckets
+        self.ttl = ttl
+        self.model = None
+        self.faiss = None
+        self.enabled = True
+        # bucket -> (created_at, index, results), least recently used first
+        self.buckets = OrderedDict()
+
+    def _encode(self, symptoms: List[str]):
+        if self.model is None:
+            # Optional dependencies, imported here so the API runs without them
+            import faiss
+            from sentence_transformers import SentenceTransformer
+            self.faiss = faiss
+            self.model = SentenceTransformer(self.model_name)
+
+        text = ", ".join(_normalize(symptoms))
+        return self.model.encode([text], normalize_embeddings=True).astype('float32')
+
+    async def _aencode(self, symptoms: List[str]):
+        if not self.enabled or not symptoms:
+            return None
+
+        try:
+            return await asyncio.to_thread(self._encode, symptoms)
+        except Exception as e:
+            # Not installed, or the model could not be loaded (offline, hub error): stop
+            # retrying the load on every call and run without the cache
+            logger.warning("Semantic research cache disabled: %s", e)
+            self.enabled = False
+            return None
+
+    def _bucket(self, iteration: int, context: str):
+        return iteration, hashlib.sha256(_normalize(context).encode()).hexdigest()
+
+    def _get_bucket(self, bucket):
+        entry = self.buckets.get(bucket)
+        if entry is None:
+            return None
+
+        if time.monotonic() - entry[0] > self.ttl:
+            del self.buckets[bucket]
+            return None
+
+        self.buckets.move_to_end(bucket)
+        return entry
+
+    async def lookup(self, symptoms: List[str], iteration: int, context: str):
+        bucket = self._bucket(iteration, context)
+        if self._get_bucket(bucket) is None:
+            return None
+
+        vector = await self._aencode(symptoms)
+        if vector is None:
+            return None
+
+        # Re-read after the await, the bucket may have been evicted meanwhile
+        entry = self.buckets.get(bucket)
+        if entry is None:
+            return None
+        _, index, results = entry
+
+        # Inner product of normalized vectors is cosine similarity
+        scores, ids = index.search(vector, 1)
+        if scores[0][0] < self.threshold:
+            return None
+        return results[ids[0][0]]
+
+    async def store(self, symptoms: List[str], iteration: int, context: str, result):
+        vector = await self._aencode(symptoms)
+        if vector is None:
+            return
+
+        bucket = self._bucket(iteration, context)
+        entry = self._get_bucket(bucket)
+        if entry is None:
+            entry = self.buckets[bucket] = (time.monotonic(), self.faiss.IndexFlatIP(vector.shape[1]), [])
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+
+        _, index, results = entry
+        index.add(vector)
+        results.append(result)
+
+semantic_research_cache = SemanticResearchCache()
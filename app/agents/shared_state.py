@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Annotated
 from operator import add
 
@@ -9,19 +9,24 @@ def accumulate_conversation(left: List[str], right: List[str]) -> List[str]:
     if not right:
         return left
     
-    result = left.copy()
-    for item in right:
-        if item not in result:  
-            result.append(item)
+    result = list(left)
+    try:
+        seen = set(left)
+        result.extend(item for item in right if not (item in seen or seen.add(item)))
+    except TypeError:
+        # Unhashable entries, fall back to list membership checks
+        for item in right:
+            if item not in result:
+                result.append(item)
     return result
 
-def increment_counter(left: int, right: int) -> int:
-    """Take the maximum of two integers (for incrementing counter)"""
-    if left is None:
-        return right or 0
-    if right is None:
-        return left
-    return max(left, right)
+REQUIRED_SYMPTOM_FIELDS = (
+    'parsed_symptoms',
+    'body_parts_affected',
+    'time_since_start',
+    'evolution_of_symptoms',
+    'medical_checks'
+)
 
 class SymptomAnalysis(BaseModel):
     parsed_symptoms: list[str] = Field(description="Individual symptoms extracted")
@@ -31,6 +36,27 @@ class SymptomAnalysis(BaseModel):
     medical_checks: Optional[list[str]] = Field(description="The result of possible medical checks around the symptoms")
     follow_up_questions: Optional[list[str]] = []
 
+    @field_validator('parsed_symptoms', mode='before')
+    @classmethod
+    def normalize_symptoms(cls, value):
+        """Trim and lowercase symptoms once here, so merging and searching get canonical strings"""
+        if not isinstance(value, list):
+            return value
+        return [clean for symptom in value if isinstance(symptom, str) and (clean := symptom.strip().lower())]
+
+    def missing_fields(self) -> list[str]:
+        """Names of the required fields that still have no data (empty lists/strings count as missing)"""
+        missing = []
+        for name in REQUIRED_SYMPTOM_FIELDS:
+            value = getattr(self, name)
+            if not value or (isinstance(value, str) and not value.strip()):
+                missing.append(name)
+        return missing
+
+    def is_complete(self) -> bool:
+        """Whether every required field has data"""
+        return not self.missing_fields()
+
 class WebResearchAgentInformation(BaseModel):
     possible_conditions: List[str] = Field(description="Potential medical conditions found")
     symptom_explanations: List[str] = Field(description="Explanations for symptoms")
@@ -61,8 +87,18 @@ class DiagnosticState(BaseModel):
         default_factory=list, 
         description="Full conversation history"
     )
+
+    conversation_summary: str = Field(
+        default="",
+        description="LLM summary of the history entries that no longer fit in the prompt window"
+    )
+    summarized_history_count: int = Field(
+        default=0,
+        description="Number of leading conversation_history entries covered by conversation_summary"
+    )
     
-    interaction_count: Annotated[int, increment_counter] = Field(
+    # Nodes return a delta (1 per parser pass) that is summed into the total
+    interaction_count: Annotated[int, add] = Field(
         default=0, 
         description="Number of interactions in this session"
     )
\ No newline at end of file
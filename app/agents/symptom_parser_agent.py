@@ -3,15 +3,24 @@ from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTempla
 from langchain_core.runnables import Runnable, RunnablePassthrough
 from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
 from langchain_core.tools import BaseTool, tool
-from langchain_groq import ChatGroq
 from pydantic import BaseModel, Field
 
 from .shared_state import SymptomAnalysis, DiagnosticState
+from .web_research_agent import prewarm_web_research
+from .llm import get_llm
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent history entries sent verbatim, older ones are folded into a summary
+HISTORY_WINDOW = 6
 
 class SymptomParserAgent:
     def __init__(self, model=None):
-        self.llm = model or ChatGroq(model="llama-3.1-8b")
+        self.llm = model or get_llm("llama-3.1-8b")
         self.parser = PydanticOutputParser(pydantic_object=SymptomAnalysis)
+        self._format_instructions = self.parser.get_format_instructions()
 
         system_message_template = SystemMessagePromptTemplate.from_template("""
             You are a medical symptom analyzer focused on DATA COLLECTION.
@@ -19,7 +28,7 @@ class SymptomParserAgent:
 
             CONTEXT: 
             - Previous analysis: {previous_analysis}
-            - Full conversation history: {conversation_history}
+            - Conversation so far (summary of older turns, then recent entries): {conversation_history}
             - Interaction number: {interaction_count}
 
             REQUIRED DATA FIELDS TO COLLECT:
@@ -75,10 +84,22 @@ class SymptomParserAgent:
         self.prompt = ChatPromptTemplate.from_messages([
             system_message_template,
             human_message_template
-        ])
+        ]).partial(format_instructions=self._format_instructions)
 
         self.chain = self.prompt | self.llm | self.parser
 
+        summary_prompt = ChatPromptTemplate.from_template("""
+            Summarize this patient intake conversation in a few short sentences.
+            Keep every symptom detail, body part, timeline fact, medical check and
+            every question that was already asked. Do not add anything new.
+
+            Existing summary: {summary}
+
+            New conversation entries:
+            {entries}
+        """)
+        self.summary_chain = summary_prompt | self.llm | StrOutputParser()
+
     async def process(self, state: DiagnosticState) -> dict:
         """
         Process input and return state updates.
@@ -86,19 +107,32 @@ class SymptomParserAgent:
         BEST PRACTICE: Return only the fields that should be updated.
         LangGraph will merge these with existing state using reducers.
         """
-        format_instructions = self.parser.get_format_instructions()
-        
-        history_text = "\n".join(state.conversation_history) if state.conversation_history else "No previous conversation"
-        previous_analysis = state.symptom_analysis.model_dump() if state.symptom_analysis else "None - first analysis"
+        history_text = self.format_history(state)
+        previous_analysis = self.format_previous_analysis(state.symptom_analysis)
         new_interaction_count = state.interaction_count + 1
 
-        new_result = await self.chain.ainvoke({
-            'format_instructions': format_instructions,
-            'user_request': state.user_request,
-            'previous_analysis': previous_analysis,
-            'conversation_history': history_text,
-            'interaction_count': new_interaction_count
-        })
+        # Fold entries that fell out of the window into the summary, alongside the main call
+        history = state.conversation_history
+        summarize_until = len(history) - HISTORY_WINDOW
+        summary_task = None
+        if summarize_until > state.summarized_history_count:
+            summary_task = asyncio.create_task(self.summarize_history(
+                state.conversation_summary,
+                history[state.summarized_history_count:summarize_until]
+            ))
+
+        try:
+            new_result = await self.chain.ainvoke({
+                'user_request': state.user_request,
+                'previous_analysis': previous_analysis,
+                'conversation_history': history_text,
+                'interaction_count': new_interaction_count
+            })
+        except BaseException:
+            # Don't leave the summary LLM call running for a node that failed
+            if summary_task:
+                summary_task.cancel()
+            raise
 
         if state.symptom_analysis:
             merged_analysis = self.merge_analyses(state.symptom_analysis, new_result)
@@ -115,13 +149,56 @@ class SymptomParserAgent:
 
         all_complete = self.is_analysis_complete(merged_analysis, new_interaction_count)
 
-        return {
+        if all_complete:
+            # Web research comes next, start its searches while this response goes back to the user
+            prewarm_web_research(merged_analysis.parsed_symptoms)
+
+        updates = {
             'symptom_analysis': merged_analysis,
             'conversation_history': new_history_entries, 
-            'interaction_count': new_interaction_count,
+            'interaction_count': 1,
             'symptom_parsing_finished': all_complete
         }
 
+        if summary_task:
+            summary = await summary_task
+            if summary:
+                updates['conversation_summary'] = summary
+                updates['summarized_history_count'] = summarize_until
+
+        return updates
+
+    def format_history(self, state: DiagnosticState) -> str:
+        """Running summary of older turns followed by the entries not yet summarized"""
+        recent = state.conversation_history[state.summarized_history_count:]
+        if not state.conversation_summary:
+            return "\n".join(recent) if recent else "No previous conversation"
+
+        return f"Summary of earlier conversation: {state.conversation_summary}\n" + "\n".join(recent)
+
+    async def summarize_history(self, summary: str, entries: list[str]) -> str:
+        try:
+            return await self.summary_chain.ainvoke({
+                'summary': summary or "None",
+                'entries': "\n".join(entries)
+            })
+        except Exception as e:
+            # The entries stay unsummarized and are retried on the next turn
+            logger.warning("Conversation summary failed: %s", e)
+            return ""
+
+    def format_previous_analysis(self, analysis: SymptomAnalysis) -> str:
+        """
+        Compact view of the previous analysis for the prompt: only the fields that
+        already have data, plus the names of the fields still missing.
+        """
+        if not analysis:
+            return "None - first analysis"
+
+        missing = analysis.missing_fields()
+        collected = analysis.model_dump_json(exclude={'follow_up_questions', *missing})
+        return f"{collected}\nStill missing: {', '.join(missing) if missing else 'nothing'}"
+
     def merge_analyses(self, previous: SymptomAnalysis, new: SymptomAnalysis) -> SymptomAnalysis:
         """
         Safely merge previous analysis with new analysis.
@@ -135,11 +212,15 @@ class SymptomParserAgent:
             if not new_list:
                 return prev_list
             
-            combined = prev_list.copy()
+            combined = list(prev_list)
             
-            for new_item in new_list:
-                if new_item not in combined:
-                    combined.append(new_item)
+            try:
+                seen = set(prev_list)
+                combined.extend(item for item in new_list if not (item in seen or seen.add(item)))
+            except TypeError:
+                for new_item in new_list:
+                    if new_item not in combined:
+                        combined.append(new_item)
             
             return combined
 
@@ -159,30 +240,4 @@ class SymptomParserAgent:
         )
     
     def is_analysis_complete(self, analysis: SymptomAnalysis, interaction_count: int) -> bool:
-        required_fields = [
-            analysis.parsed_symptoms,
-            analysis.body_parts_affected, 
-            analysis.time_since_start,
-            analysis.evolution_of_symptoms,
-            analysis.medical_checks
-        ]
-
-        all_data_complete = True
-        
-        for field in required_fields:
-            if field is None:
-                all_data_complete = False
-                break
-            
-            if isinstance(field, list) and len(field) == 0:
-                all_data_complete = False
-                break
-                
-            if isinstance(field, str) and not field.strip():
-                all_data_complete = False
-                break
-
-        if all_data_complete or interaction_count >= 5:
-            return True
-        
-        return False
\ No newline at end of file
+        return analysis.is_complete() or interaction_count >= 5
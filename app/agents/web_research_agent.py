@@ -1,17 +1,56 @@
 from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage, AIMessage
 from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_groq import ChatGroq
 from langchain.tools import BaseTool, tool
 from langchain_community.tools import DuckDuckGoSearchResults
 from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
 from .shared_state import DiagnosticState, WebResearchAgentInformation
+from .llm import get_http_client, get_llm
+from .research_cache import cached_tool, semantic_research_cache
 from langchain_core.output_parsers import PydanticOutputParser
+from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import RatelimitException
 import re
 import asyncio
-from typing import Dict, List, Optional
+import html
+import functools
+import hashlib
+import logging
+import random
+import threading
+import time
+import tiktoken
+import httpx
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
 
-search_wrapper = DuckDuckGoSearchAPIWrapper(
+logger = logging.getLogger(__name__)
+
+class PooledDuckDuckGoSearchAPIWrapper(DuckDuckGoSearchAPIWrapper):
+    """
+    DuckDuckGoSearchAPIWrapper opens a new DDGS session (and TCP/TLS connection) per query.
+    Keep one session per worker thread instead, so keep-alive connections are reused.
+    Searches run in the default executor, and a DDGS session is not shared across threads.
+    """
+
+    def _ddgs_text(self, query: str, max_results: Optional[int] = None) -> List[Dict[str, str]]:
+        ddgs = getattr(_ddgs_sessions, 'ddgs', None)
+        if ddgs is None:
+            ddgs = _ddgs_sessions.ddgs = DDGS()
+
+        results = ddgs.text(
+            query,
+            region=self.region,
+            safesearch=self.safesearch,
+            timelimit=self.time,
+            max_results=max_results or self.max_results,
+            backend=self.backend
+        )
+        return list(results) if results else []
+
+_ddgs_sessions = threading.local()
+
+search_wrapper = PooledDuckDuckGoSearchAPIWrapper(
     region="us-en",  
     safesearch="moderate",
     time="y",  
@@ -19,32 +58,304 @@ search_wrapper = DuckDuckGoSearchAPIWrapper(
 )
 search = DuckDuckGoSearchResults(api_wrapper=search_wrapper)
 
+DDG_MAX_CONCURRENCY = 8
+DDG_REQUESTS_PER_SECOND = 20
+DDG_MAX_RETRIES = 3
+DDG_BACKOFF_BASE_SECONDS = 1.0
+
+class AsyncTokenBucket:
+    """
+    Async context manager allowing at most `rate` entries per `period` seconds,
+    with bursts up to `rate`. Waiters queue on a lock so tokens go out in order.
+    """
+
+    def __init__(self, rate: int, period: float = 1.0):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return self
+
+                await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+# Shared by every request in the process, query variants fan out quickly otherwise
+_DDG_SEM = asyncio.Semaphore(DDG_MAX_CONCURRENCY)
+_DDG_LIMITER = AsyncTokenBucket(DDG_REQUESTS_PER_SECOND, 1)
+
+def _release_ddg_slot(task: asyncio.Task):
+    _DDG_SEM.release()
+    # Mark a failure retrieved, the caller may have been cancelled and stopped waiting
+    if not task.cancelled():
+        task.exception()
+
+async def _rate_limited_search(query: str):
+    """search.ainvoke behind the process-wide limits, retrying rate limit errors with jittered backoff"""
+    for attempt in range(DDG_MAX_RETRIES + 1):
+        await _DDG_SEM.acquire()
+        try:
+            async with _DDG_LIMITER:
+                task = asyncio.ensure_future(search.ainvoke(query))
+        except BaseException:
+            _DDG_SEM.release()
+            raise
+
+        # The DDGS call runs in an executor thread that cancelling cannot stop, so the slot
+        # is held until the search itself finishes, not until this caller stops waiting
+        task.add_done_callback(_release_ddg_slot)
+        try:
+            return await asyncio.shield(task)
+        except RatelimitException:
+            if attempt == DDG_MAX_RETRIES:
+                raise
+
+            # Back off outside the semaphore so other queries can use the slot
+            delay = DDG_BACKOFF_BASE_SECONDS * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+# Prewarmed, cached and repeated queries often return the same raw text within a session
+@functools.lru_cache(maxsize=4096)
 def clean_search_results(results: str) -> str:
     """Clean and filter search results for medical relevance"""
     if not results or results == "No good DuckDuckGo Search Result was found":
         return "No relevant medical information found."
     
     # Remove non-English or irrelevant content
-    lines = results.split('\n')
     filtered_lines = []
     
-    for line in lines:
+    for line in results.split('\n'):
         line = line.strip()
         if not line:
             continue
-            
-        non_ascii_ratio = sum(1 for c in line if ord(c) > 127) / len(line) if line else 0
-        if non_ascii_ratio > 0.3:
+        
+        # encode() counts ASCII characters in C instead of a per-character Python loop
+        ascii_ratio = len(line.encode('ascii', 'ignore')) / len(line)
+        if ascii_ratio < 0.7:
             continue
             
         filtered_lines.append(line)
+        if len(filtered_lines) == 10:
+            break
     
-    return '\n'.join(filtered_lines[:10]) if filtered_lines else "No relevant medical information found."
+    return '\n'.join(filtered_lines) if filtered_lines else "No relevant medical information found."
+
+# Searches started ahead of time by prewarm_web_research, keyed by their query plan
+_prewarmed_searches: Dict[str, asyncio.Task] = {}
+PREWARM_TTL_SECONDS = 600
+SEARCH_TIMEOUT_SECONDS = 20
+
+def _search_key(queries: List[str]) -> str:
+    return hashlib.blake2b("\n".join(queries).encode()).hexdigest()
+
+# Query variants per search tool, filled in with str.format(s=...)
+_SINGLE_TEMPLATES = (
+    "{s} medical causes symptoms treatment",
+    "{s} health condition diagnosis symptoms",
+    "what causes {s} medical reasons"
+)
+
+_MULTI_TEMPLATES = (
+    "{s} together medical condition diagnosis",
+    "conditions causing {s} simultaneously symptoms",
+    "{s} combination medical causes differential diagnosis",
+    "what disease causes {s} together medical"
+)
+
+_REDFLAG_TEMPLATES = (
+    "{s} emergency warning signs when to see doctor immediately",
+    "{s} red flags urgent medical attention",
+    "{s} serious symptoms emergency room hospital",
+    "dangerous {s} warning signs emergency medical care"
+)
+
+def _format_queries(templates, text: str) -> List[str]:
+    return [template.format(s=text) for template in templates]
+
+async def _search_query(query: str, label: str):
+    """Run one query, return (query, cleaned results) or (query, None) on failure"""
+    try:
+        logger.debug("%s search query: %s", label, query)
+        result = await _rate_limited_search(query)
+        return query, clean_search_results(str(result))
+    except Exception as e:
+        logger.warning("%s search failed for query '%s': %s", label, query, e)
+        return query, None
+
+async def _run_search_queries(queries: List[str], label: str):
+    """
+    Run all query variants concurrently and return (query, cleaned results)
+    for the first one that comes back useful; the rest are cancelled.
+    """
+    tasks = [asyncio.create_task(_search_query(query, label)) for query in queries]
+
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=SEARCH_TIMEOUT_SECONDS):
+            query, cleaned_result = await next_done
+            
+            if cleaned_result and "No relevant medical information found" not in cleaned_result:
+                return query, cleaned_result
+
+    except asyncio.TimeoutError:
+        logger.warning("%s search timed out after %ss", label, SEARCH_TIMEOUT_SECONDS)
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return None, None
+
+async def _first_useful_result(queries: List[str], label: str):
+    """Same as _run_search_queries, but picks up a prewarmed search for the same queries"""
+    task = _prewarmed_searches.pop(_search_key(queries), None)
+    if task is not None:
+        try:
+            best_query, best_result = await task
+            if best_result is not None:
+                return best_query, best_result
+            # Every prewarmed variant failed or timed out, search again for the real request
+            logger.debug("Prewarmed %s search found nothing, searching again", label)
+        except Exception as e:
+            logger.warning("Prewarmed %s search failed: %s", label, e)
+
+    return await _run_search_queries(queries, label)
+
+def _expire_prewarmed(key: str, task: asyncio.Task):
+    if _prewarmed_searches.get(key) is task:
+        del _prewarmed_searches[key]
+
+def prewarm_web_research(symptoms: List[str]):
+    """
+    Start the combined-symptom and red-flag searches in the background so
+    web_researcher finds them already running (or finished) when it is invoked.
+    """
+    clean_symptoms = [clean for s in symptoms if (clean := s.strip().lower())]
+    if not clean_symptoms:
+        return
+
+    symptoms_text = ', '.join(clean_symptoms)
+    loop = asyncio.get_running_loop()
+
+    for queries, label in (
+        (_format_queries(_MULTI_TEMPLATES, symptoms_text), "Multi-symptom"),
+        (_format_queries(_REDFLAG_TEMPLATES, symptoms_text), "Red flags")
+    ):
+        key = _search_key(queries)
+        if key in _prewarmed_searches:
+            continue
+
+        task = asyncio.create_task(_run_search_queries(queries, label))
+        _prewarmed_searches[key] = task
+
+        # Drop speculative results nobody asked for
+        loop.call_later(PREWARM_TTL_SECONDS, _expire_prewarmed, key, task)
+
+MEDLINEPLUS_SEARCH_URL = "https://wsearch.nlm.nih.gov/ws/query"
+MEDLINEPLUS_MAX_TOPICS = 3
+MEDLINEPLUS_SUMMARY_CHARS = 600
+MEDLINEPLUS_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Health topic summaries change rarely, keep them for a day: term -> (expires at, result)
+_medline_cache: Dict[str, Tuple[float, Optional[str]]] = {}
+_MARKUP_RE = re.compile(r'<[^>]+>')
+
+def _parse_medline_results(xml_text: str) -> str:
+    """Title, URL and summary of the top MedlinePlus health topics in a search response"""
+    topics = []
+    for document in ET.fromstring(xml_text).iter('document'):
+        fields = {
+            content.get('name'): html.unescape(_MARKUP_RE.sub('', ''.join(content.itertext()))).strip()
+            for content in document.findall('content')
+        }
+        title = fields.get('title')
+        summary = fields.get('FullSummary') or fields.get('snippet')
+        if title and summary:
+            topics.append(f"{title} ({document.get('url')}): {summary[:MEDLINEPLUS_SUMMARY_CHARS]}")
+        if len(topics) == MEDLINEPLUS_MAX_TOPICS:
+            break
+    return '\n'.join(topics)
+
+async def _medline_search(term: str) -> Optional[str]:
+    """MedlinePlus health topics matching term, None when nothing matched or the request failed"""
+    now = time.monotonic()
+    cached = _medline_cache.get(term)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    try:
+        response = await get_http_client().get(
+            MEDLINEPLUS_SEARCH_URL,
+            params={'db': 'healthTopics', 'term': term, 'retmax': MEDLINEPLUS_MAX_TOPICS},
+            timeout=10
+        )
+        response.raise_for_status()
+        result = _parse_medline_results(response.text) or None
+    except (httpx.HTTPError, ET.ParseError) as e:
+        # Not cached, the next call tries MedlinePlus again
+        logger.warning("MedlinePlus search failed for '%s': %s", term, e)
+        return None
+
+    if len(_medline_cache) >= 4096:
+        for key in [key for key, (expires, _) in _medline_cache.items() if expires <= now]:
+            del _medline_cache[key]
+    _medline_cache[term] = (now + MEDLINEPLUS_CACHE_TTL_SECONDS, result)
+    return result
+
+PREVIOUS_CONTEXT_TOKEN_BUDGET = 1500
+PREVIOUS_CONTEXT_RECENT_ENTRIES = 2
+
+@functools.lru_cache(maxsize=1)
+def _context_encoding():
+    # Not the Llama tokenizer, but close enough to budget prompt tokens
+    return tiktoken.encoding_for_model("gpt-4")
+
+def build_previous_context(info: Optional[WebResearchAgentInformation]) -> str:
+    """
+    Findings from earlier iterations for the prompt: the latest search summary stands in
+    for older results, only the most recent raw entries are kept, and the text is capped
+    at PREVIOUS_CONTEXT_TOKEN_BUDGET tokens. The summary keeps its room first, the raw
+    entries get what is left (keeping their end).
+    """
+    if not info:
+        return "No previous research"
+
+    summary = f"Summary of earlier research: {info.search_summary}" if info.search_summary else ""
+    entries = "\n".join((info.previous_search_results or [])[-PREVIOUS_CONTEXT_RECENT_ENTRIES:])
+    if not summary and not entries:
+        return "No previous research"
+
+    text = "\n".join(part for part in (summary, entries) if part)
+    # Every BPE token covers at least one byte, so texts this short cannot exceed the budget
+    if len(text.encode()) <= PREVIOUS_CONTEXT_TOKEN_BUDGET:
+        return text
+
+    encoding = _context_encoding()
+    summary_tokens = encoding.encode(summary)[:PREVIOUS_CONTEXT_TOKEN_BUDGET]
+    entries_budget = PREVIOUS_CONTEXT_TOKEN_BUDGET - len(summary_tokens)
+
+    parts = [encoding.decode(summary_tokens)] if summary_tokens else []
+    if entries and entries_budget > 0:
+        parts.append(encoding.decode(encoding.encode(entries)[-entries_budget:]))
+    return "\n".join(parts)
 
 @tool
+@cached_tool
 async def web_search_for_single_symptom(symptom: str = '') -> dict:
     """
-    Search the web for medical information about a single symptom.
+    Search for medical information about a single symptom, from MedlinePlus health
+    topics when available, otherwise from the web.
     
     Args:
         symptom: The symptom to search for (e.g., "headache", "chest pain")
@@ -56,35 +367,24 @@ async def web_search_for_single_symptom(symptom: str = '') -> dict:
         return {'query': '', 'results': 'No symptom provided', 'status': 'error'}
     
     clean_symptom = symptom.strip().lower()
+
+    medline_result = await _medline_search(clean_symptom)
+    if medline_result:
+        return {
+            'query': clean_symptom,
+            'results': medline_result,
+            'source': 'MedlinePlus',
+            'status': 'success'
+        }
     
-    medical_queries = [
-        f"{clean_symptom} medical causes symptoms treatment",
-        f"{clean_symptom} health condition diagnosis symptoms",
-        f"what causes {clean_symptom} medical reasons"
-    ]
-    
-    best_result = None
-    best_query = ""
-    
-    for query in medical_queries:
-        try:
-            result = await search.ainvoke(query)
-            cleaned_result = clean_search_results(str(result))
-            
-            if cleaned_result and "No relevant medical information found" not in cleaned_result:
-                best_result = cleaned_result
-                best_query = query
-                break
-                
-            await asyncio.sleep(1)
-            
-        except Exception as e:
-            print(f"Search attempt failed for query '{query}': {e}")
-            continue
+    # Nothing curated for this symptom, fall back to a general web search
+    medical_queries = _format_queries(_SINGLE_TEMPLATES, clean_symptom)
+    best_query, best_result = await _first_useful_result(medical_queries, "Single-symptom")
     
     if best_result:
-        print(f"Successful search - Query: {best_query}")
-        print(f"Results: {best_result[:200]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Successful search - Query: %s", best_query)
+            logger.debug("Results: %s...", best_result[:200])
         return {
             'query': best_query,
             'results': best_result,
@@ -99,6 +399,34 @@ async def web_search_for_single_symptom(symptom: str = '') -> dict:
         }
 
 @tool
+async def web_search_for_symptom_list(symptoms: list[str]) -> list[dict]:
+    """
+    Search the web for medical information about each symptom in a list, all at once.
+    Use this instead of calling web_search_for_single_symptom once per symptom.
+    
+    Args:
+        symptoms: List of symptoms to research individually
+        
+    Returns:
+        List with one dictionary (search query, results, and status) per symptom
+    """
+    if not symptoms:
+        return []
+
+    results = await web_search_for_single_symptom.abatch(
+        [{'symptom': symptom} for symptom in symptoms],
+        config={'max_concurrency': 8},
+        return_exceptions=True
+    )
+
+    return [
+        {'query': symptom, 'results': f'Search failed: {result}', 'status': 'error'}
+        if isinstance(result, BaseException) else result
+        for symptom, result in zip(symptoms, results)
+    ]
+
+@tool
+@cached_tool
 async def web_search_multiple_symptoms_together(symptoms: list[str]) -> dict:
     """
     Search for medical conditions that could cause multiple symptoms together.
@@ -116,7 +444,7 @@ async def web_search_multiple_symptoms_together(symptoms: list[str]) -> dict:
             'status': 'error'
         }
     
-    clean_symptoms = [s.strip().lower() for s in symptoms if s.strip()]
+    clean_symptoms = [clean for s in symptoms if (clean := s.strip().lower())]
     if not clean_symptoms:
         return {
             'query': '',
@@ -126,32 +454,8 @@ async def web_search_multiple_symptoms_together(symptoms: list[str]) -> dict:
     
     symptoms_text = ', '.join(clean_symptoms)
     
-    medical_queries = [
-        f"{symptoms_text} together medical condition diagnosis",
-        f"conditions causing {symptoms_text} simultaneously symptoms",
-        f"{symptoms_text} combination medical causes differential diagnosis",
-        f"what disease causes {symptoms_text} together medical"
-    ]
-    
-    best_result = None
-    best_query = ""
-    
-    for query in medical_queries:
-        try:
-            print(f"Multi-symptom search query: {query}")
-            result = await search.ainvoke(query)
-            cleaned_result = clean_search_results(str(result))
-            
-            if cleaned_result and "No relevant medical information found" not in cleaned_result:
-                best_result = cleaned_result
-                best_query = query
-                break
-                
-            await asyncio.sleep(1)
-            
-        except Exception as e:
-            print(f"Multi-symptom search failed for query '{query}': {e}")
-            continue
+    medical_queries = _format_queries(_MULTI_TEMPLATES, symptoms_text)
+    best_query, best_result = await _first_useful_result(medical_queries, "Multi-symptom")
     
     if best_result:
         return {
@@ -170,6 +474,7 @@ async def web_search_multiple_symptoms_together(symptoms: list[str]) -> dict:
         }
 
 @tool
+@cached_tool
 async def search_medical_red_flags(symptoms: str) -> dict:
     """
     Search specifically for emergency warning signs and red flags related to symptoms.
@@ -189,32 +494,8 @@ async def search_medical_red_flags(symptoms: str) -> dict:
     
     clean_symptoms = symptoms.strip().lower()
     
-    emergency_queries = [
-        f"{clean_symptoms} emergency warning signs when to see doctor immediately",
-        f"{clean_symptoms} red flags urgent medical attention",
-        f"{clean_symptoms} serious symptoms emergency room hospital",
-        f"dangerous {clean_symptoms} warning signs emergency medical care"
-    ]
-    
-    best_result = None
-    best_query = ""
-    
-    for query in emergency_queries:
-        try:
-            print(f"Red flags search query: {query}")
-            result = await search.ainvoke(query)
-            cleaned_result = clean_search_results(str(result))
-            
-            if cleaned_result and "No relevant medical information found" not in cleaned_result:
-                best_result = cleaned_result
-                best_query = query
-                break
-                
-            await asyncio.sleep(1)
-            
-        except Exception as e:
-            print(f"Red flags search failed for query '{query}': {e}")
-            continue
+    emergency_queries = _format_queries(_REDFLAG_TEMPLATES, clean_symptoms)
+    best_query, best_result = await _first_useful_result(emergency_queries, "Red flags")
     
     if best_result:
         return {
@@ -233,62 +514,40 @@ async def search_medical_red_flags(symptoms: str) -> dict:
         }
 
 class WebResearchAgent:
-    def __init__(self, model):
-        self.model = model or ChatGroq(model='llama-3.1-8b-instant', temperature=0.1)
+    def __init__(self, model, synthesis_model=None):
+        self.model = model or get_llm('llama-3.1-8b-instant')
+        self.synthesis_model = synthesis_model or self.model
         self.parser = PydanticOutputParser(pydantic_object=WebResearchAgentInformation)
-        self.tools = [web_search_for_single_symptom, web_search_multiple_symptoms_together, search_medical_red_flags]
+        self.format_instructions = self.parser.get_format_instructions()
+        self.tools = [web_search_for_symptom_list, web_search_for_single_symptom, web_search_multiple_symptoms_together, search_medical_red_flags]
         
-        system_message = SystemMessagePromptTemplate.from_template("""
-            You are an expert medical research agent that searches the web for symptom information and provides evidence-based analysis.
-
-            CORE RESPONSIBILITIES:
-            1. Systematically research patient symptoms using available tools
-            2. Analyze and synthesize medical information from web sources
-            3. Identify potential conditions, causes, and explanations
-            4. Flag emergency warning signs and red flags
-            5. Provide confidence-rated summaries of findings
-
-            RESEARCH METHODOLOGY:
-            - Begin with individual symptom analysis using web_search_for_single_symptom
-            - Progress to symptom combination searches using web_search_multiple_symptoms_together
-            - Always investigate emergency signs using search_medical_red_flags
-            - Cross-reference findings across multiple searches for reliability
-            - Prioritize recent, authoritative medical sources
-
-            SEARCH STRATEGY:
-            - Use precise medical terminology when possible
-            - Search for both common and rare conditions
-            - Look for patterns and symptom clusters
-            - Identify differential diagnosis possibilities
-            - Focus on actionable medical information
-
-            SAFETY PROTOCOLS:
-            - Always err on the side of caution for patient safety
-            - Immediately flag potential emergency situations
+        system_prompt = """
+            You are an expert medical research agent that researches patient symptoms on the web and provides evidence-based analysis.
+
+            RESEARCH:
+            - Search individual symptoms (web_search_for_symptom_list for several at once), the symptom combination (web_search_multiple_symptoms_together) and emergency signs (search_medical_red_flags)
+            - Cross-reference findings and prefer authoritative medical sources
+            - Results with Source: MedlinePlus are curated NLM health topics, trust them over general web results
+            - Consider both common and rare conditions (differential diagnosis)
+
+            SAFETY:
+            - Err on the side of caution and flag potential emergencies
+            - Suggest possibilities only, never definitive diagnoses
             - Recommend medical consultation for serious symptoms
-            - Avoid definitive diagnoses - suggest possibilities only
-            - Maximum 5 tool calls to maintain efficiency
-
-            ANALYSIS FRAMEWORK:
-            When search results are limited or unclear:
-            - Acknowledge limitations honestly
-            - Recommend professional medical evaluation
-            - Focus on what information is available
-            - Suggest follow-up questions for healthcare providers
-
-            OUTPUT REQUIREMENTS:
-            Provide structured analysis including:
-            - Possible medical conditions found (with likelihood if determinable)
-            - Clear explanations of symptoms and their medical significance
-            - Emergency warning signs and red flags (if any)
-            - Confidence level: high/medium/low based on search result quality
-            - Recommendation for additional research or medical consultation
+            - When results are limited, say so and recommend professional evaluation
+            - Maximum 5 tool calls
+
+            OUTPUT: possible conditions, symptom explanations, red flags, follow-up questions for healthcare providers,
+            and a high/medium/low confidence level based on search result quality.
 
             CURRENT CASE CONTEXT:
             Patient symptoms: {symptoms}
             Research iteration: {iteration}
             Previous findings: {previous_context}
-                                                                   
+        """
+
+        # The tool-calling agent answers in text, so it needs the schema spelled out
+        system_message = SystemMessagePromptTemplate.from_template(system_prompt + """
             Format your response according to these specifications:
             {format_instructions}
         """)
@@ -311,7 +570,32 @@ class WebResearchAgent:
             system_message, 
             human_message,
             MessagesPlaceholder(variable_name='agent_scratchpad')
-        ])
+        ]).partial(format_instructions=self.format_instructions)
+
+        synthesis_human_message = HumanMessagePromptTemplate.from_template("""
+            Analyze these symptoms using the web search results below. The searches have
+            already been run for you (individual symptoms, the combination, and red flags),
+            so do not request any more tool calls:
+
+            PRIMARY SYMPTOMS: {symptoms}
+
+            ADDITIONAL CONTEXT:
+            - Affected body parts: {body_parts}
+            - Symptom timeline: {timeline} 
+            - Symptom evolution: {evolution}
+            - Previous medical evaluations: {medical_checks}
+
+            SEARCH RESULTS:
+            {search_results}
+
+            Provide a thorough medical analysis based on these findings.
+        """)
+
+        # Synthesis is decoded straight into WebResearchAgentInformation, no schema in the prompt
+        self.synthesis_chain = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(system_prompt),
+            synthesis_human_message
+        ]) | self.synthesis_model.with_structured_output(WebResearchAgentInformation, include_raw=True)
 
         self.agent = create_tool_calling_agent(
             llm=self.model,
@@ -325,15 +609,45 @@ class WebResearchAgent:
             max_iterations=5,  
             early_stopping_method="generate",
             handle_parsing_errors=True,
-            verbose=True
+            verbose=logger.isEnabledFor(logging.DEBUG)
+        )
+
+    async def run_searches(self, symptoms: List[str], symptoms_str: str) -> str:
+        """
+        Run the whole research plan concurrently: each symptom alone, the combination,
+        and red flags. Returns the results formatted for the synthesis prompt, or an
+        empty string when there is nothing to search or every search raised.
+        """
+        if not symptoms:
+            return ""
+
+        symptom_results, *combined_results = await asyncio.gather(
+            web_search_for_symptom_list.ainvoke({'symptoms': symptoms}),
+            web_search_multiple_symptoms_together.ainvoke({'symptoms': symptoms}),
+            search_medical_red_flags.ainvoke({'symptoms': symptoms_str}),
+            return_exceptions=True
         )
 
+        # gather hands back cancellations too, which are not Exception subclasses
+        if isinstance(symptom_results, BaseException):
+            symptom_results = [symptom_results]
+
+        sections = []
+        for result in symptom_results + combined_results:
+            if isinstance(result, BaseException):
+                logger.warning("Search failed: %s", result)
+                continue
+            sections.append(
+                f"Query: {result['query']}\nSource: {result.get('source', 'Web search')}\n"
+                f"Status: {result['status']}\n{result['results']}"
+            )
+
+        return "\n\n".join(sections)
+
     async def process(self, state: DiagnosticState) -> dict:
         """
         Enhanced process method with improved error handling and fallback mechanisms
         """
-        format_instructions = self.parser.get_format_instructions()
-        
         # Extract symptom information
         if state.symptom_analysis:
             symptoms = state.symptom_analysis.parsed_symptoms or []
@@ -361,37 +675,65 @@ class WebResearchAgent:
         body_parts_str = ", ".join(body_parts) if body_parts else "Not specified"
         evolution_str = ", ".join(evolution) if evolution else "Not specified"
         medical_checks_str = ", ".join(medical_checks) if medical_checks else "None reported"
-        previous_context_str = "\n".join(previous_context) if previous_context else "No previous research"
 
-        print(f"Starting medical research - Iteration {iteration}")
-        print(f"Symptoms to research: {symptoms_str}")
+        logger.debug("Starting medical research - Iteration %s", iteration)
+        logger.debug("Symptoms to research: %s", symptoms_str)
 
         try:
-            response = await self.executor.ainvoke({
+            # Inside the try: tokenizing may need to download the encoding
+            previous_context_str = build_previous_context(state.web_search_agent_information)
+
+            # Everything but the symptoms has to match exactly for a cached result to apply
+            case_context = "\n".join((body_parts_str, timeline, evolution_str, medical_checks_str, previous_context_str))
+            cached_result = await semantic_research_cache.lookup(symptoms, iteration, case_context)
+            if cached_result is not None:
+                logger.debug("Semantic cache hit for: %s", symptoms_str)
+                return {
+                    'web_search_agent_information': cached_result
+                }
+
+            inputs = {
                 'symptoms': symptoms_str,
                 'iteration': iteration,
                 'previous_context': previous_context_str,
-                'format_instructions': format_instructions,
                 'body_parts': body_parts_str,
                 'timeline': timeline,
                 'evolution': evolution_str,
                 'medical_checks': medical_checks_str
-            })
+            }
 
-            print(f"Research completed. Raw response: {response}")
-            
-            # Parse the structured response
-            try:
-                parsed_result = self.parser.parse(response['output'])
-                print(f"Successfully parsed research results")
+            search_results = await self.run_searches(symptoms, symptoms_str)
+
+            if search_results:
+                # All searches are known up front, so the LLM is only needed once to synthesize
+                response = await self.synthesis_chain.ainvoke({**inputs, 'search_results': search_results})
+                output = response['raw']
+                parsed_result = response['parsed']
+                parse_error = response['parsing_error'] or (
+                    None if parsed_result else ValueError("model returned no structured output")
+                )
+            else:
+                response = await self.executor.ainvoke(inputs)
+                output = response['output']
+                try:
+                    parsed_result, parse_error = self.parser.parse(output), None
+                except Exception as e:
+                    parsed_result, parse_error = None, e
+
+            logger.debug("Research completed. Raw response: %s", response)
+
+            if parse_error is None:
+                logger.debug("Successfully parsed research results")
+
+                await semantic_research_cache.store(symptoms, iteration, case_context, parsed_result)
                 
                 return {
                     'web_search_agent_information': parsed_result
                 }
-                
-            except Exception as parse_error:
-                print(f"Parsing error: {parse_error}")
-                print(f"Raw output to parse: {response['output']}")
+
+            else:
+                logger.warning("Parsing error: %s", parse_error)
+                logger.debug("Raw output to parse: %s", output)
                 
                 fallback_result = WebResearchAgentInformation(
                     possible_conditions=["Unable to parse research results - recommend medical consultation"],
@@ -410,7 +752,7 @@ class WebResearchAgent:
                 }
             
         except Exception as e:
-            print(f"Critical error in web research process: {e}")
+            logger.error("Critical error in web research process: %s", e, exc_info=True)
             
             error_result = WebResearchAgentInformation(
                 possible_conditions=[],
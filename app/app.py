@@ -1,13 +1,18 @@
 import logging
+import os
 from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
+import orjson
+from langchain_community.cache import SQLiteCache
+from langchain_core.globals import set_llm_cache
 
 from .agents.agent_graph import AgentGraph
-from .agents.shared_state import DiagnosticState
+from .agents.llm import get_http_client
 from .agents.web_research_agent import (
     web_search_for_single_symptom,
     web_search_multiple_symptoms_together
@@ -17,11 +22,38 @@ from .agents.web_research_agent import (
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("DiagnosticAI FastAPI server starting up")
+    # Built here rather than at import, so each worker creates (and closes) its own graph once
+    agent = AgentGraph(model_name_fast='llama-3.1-8b-instant', model_name_deep='llama-3.3-70b-versatile')
+    await agent.setup()
+    app.state.agent = agent
+
+    if os.getenv('DIAGNOSTICAI_WARMUP') == '1':
+        await warmup(agent)
+
     yield
     logger.info("DiagnosticAI FastAPI server shutting down")
+    await agent.aclose()
+    await get_http_client().aclose()
+
+async def warmup(agent: AgentGraph):
+    """
+    Open the pooled Groq connection with one tiny LLM call, so the first real request
+    does not pay for the TLS handshake. Deliberately not a graph run: that would write
+    checkpoints and could trigger searches.
+    """
+    try:
+        # Bypass the global LLM cache, a cached "ping" would never reach Groq
+        model = agent.model_for_task('symptom_parsing').model_copy(update={'cache': False})
+        await model.ainvoke("ping")
+    except Exception as e:
+        logger.warning(f"Warmup request failed: {e}")
+
+# async so FastAPI resolves it on the event loop instead of a threadpool worker
+async def get_agent(request: Request) -> AgentGraph:
+    return request.app.state.agent
 
 # Initialize FastAPI app
-app = FastAPI(lifespan=lifespan, title="DiagnosticAI API")
+app = FastAPI(lifespan=lifespan, title="DiagnosticAI API", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -60,8 +92,8 @@ class DebugRequest(BaseModel):
 class DebugMultipleRequest(BaseModel):
     symptoms: List[str] = []
 
-# Initialize agent
-agent = AgentGraph(model_name='llama-3.3-70b-versatile')
+# Identical prompts (same model and parameters) are answered from the local cache
+set_llm_cache(SQLiteCache(database_path="llm_cache.db"))
 
 # Routes
 @app.get("/health")
@@ -70,44 +102,22 @@ async def health_check():
     return {"status": "healthy", "service": "DiagnosticAI"}
 
 @app.post("/api/analyze", response_model=AnalysisResponse)
-async def analyze_symptoms(request: SymptomRequest):
+async def analyze_symptoms(request: SymptomRequest, agent: AgentGraph = Depends(get_agent)):
     """Analyze patient symptoms through multi-agent system"""
     try:
         config = {'configurable': {'thread_id': request.thread_id}}
         input_data = {"user_request": request.symptoms}
         
-        # Check existing state
-        try:
-            current_state = await agent.agent_graph.aget_state(config=config)
-            interaction_count = current_state.values.get('interaction_count', 0) if current_state.values else 0
-            logger.info(f"Thread {request.thread_id} - Interactions: {interaction_count}")
-        except Exception as e:
-            logger.warning(f"State check failed: {e}")
-        
-        # Run agent graph
-        await agent.agent_graph.ainvoke(input_data, config=config)
-        
-        # Get final state
-        final_state = await agent.agent_graph.aget_state(config=config)
-        if not final_state or not final_state.values:
+        # Run agent graph, ainvoke returns the final state values
+        state_values = await agent.agent_graph.ainvoke(input_data, config=config)
+        if not state_values:
             raise HTTPException(status_code=500, detail="Failed to get final state")
         
-        state_values = final_state.values
         symptom_analysis = state_values.get('symptom_analysis')
-        conversation_history = state_values.get('conversation_history', [])
-        interaction_count = state_values.get('interaction_count', 0)
+        logger.info(f"Thread {request.thread_id} - Interactions: {state_values.get('interaction_count', 0)}")
 
         # Check completion
-        temp_state = DiagnosticState(
-            user_request=request.symptoms,
-            symptom_analysis=symptom_analysis,
-            conversation_history=conversation_history,
-            interaction_count=interaction_count,
-            web_search_agent_information=state_values.get('web_search_agent_information'),
-            document_research_agent_information=state_values.get('document_research_agent_information')
-        )
-
-        check_result = agent.check_all_data_extracted(temp_state)
+        check_result = agent.check_values_extracted(state_values)
         logger.info(f"Check result: {check_result}")
 
         if check_result == 'continue_to_web_research':
@@ -138,7 +148,7 @@ async def analyze_symptoms(request: SymptomRequest):
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @app.get("/api/debug/state/{thread_id}")
-async def debug_state(thread_id: str):
+async def debug_state(thread_id: str, agent: AgentGraph = Depends(get_agent)):
     """Debug endpoint to inspect conversation state"""
     try:
         config = {'configurable': {'thread_id': thread_id}}
@@ -179,34 +189,64 @@ class WebResearchResponse(BaseModel):
     message: str = "Web research completed successfully"
 
 
-@app.post('/api/web-research', response_model=WebResearchResponse)
-async def web_research(request: WebResearchRequest):
-    try:
-        thread_id = request.thread_id
-        config = {'configurable': {'thread_id': thread_id}}
+def sse_event(data: Dict[str, Any]) -> str:
+    return f"data: {orjson.dumps(data).decode()}\n\n"
 
-        await agent.agent_graph.ainvoke({}, config=config)
-        
-        final_state = await agent.agent_graph.aget_state(config=config)
-        
-        if not final_state or not final_state.values:
-            raise HTTPException(status_code=500, detail="Failed to get final state after web research")
-        
-        state_values = final_state.values
-        
-        web_research_info = state_values.get('web_search_agent_information')
-        symptom_analysis = state_values.get('symptom_analysis')
-        
-        return WebResearchResponse(
-            status="success",
-            is_complete=True,
-            web_research_results=WebResearchResults(**web_research_info.model_dump()) if web_research_info else None,
-            extracted_data=symptom_analysis.model_dump() if symptom_analysis else {}
-        )
-        
-    except Exception as e:
-        logger.error(f"Web research failed - Thread: {thread_id}, Error: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Web research failed: {str(e)}")
+@app.post('/api/web-research')
+async def web_research(request: WebResearchRequest, agent: AgentGraph = Depends(get_agent)):
+    """
+    Run web research and stream it as Server-Sent Events: a 'tool_result' event per
+    finished search, 'token' events while the analysis is written, then one 'result'
+    event carrying the WebResearchResponse (or an 'error' event).
+    """
+    thread_id = request.thread_id
+    config = {'configurable': {'thread_id': thread_id}}
+
+    async def event_stream():
+        try:
+            state_values = None
+            async for event in agent.agent_graph.astream_events({}, config=config, version="v2"):
+                if event['event'] == 'on_chain_end' and not event.get('parent_ids'):
+                    # End of the graph run itself, its output is the final state
+                    state_values = event['data'].get('output')
+                elif event['event'] == 'on_tool_end':
+                    output = event['data'].get('output')
+                    output = getattr(output, 'content', output)
+                    yield sse_event({
+                        'type': 'tool_result',
+                        'tool': event['name'],
+                        'query': output.get('query') if isinstance(output, dict) else None,
+                        'status': output.get('status') if isinstance(output, dict) else None
+                    })
+                elif event['event'] == 'on_chat_model_stream':
+                    content = event['data']['chunk'].content
+                    if content:
+                        yield sse_event({'type': 'token', 'content': content})
+
+            if not state_values:
+                yield sse_event({'type': 'error', 'detail': "Failed to get final state after web research"})
+                return
+            
+            web_research_info = state_values.get('web_search_agent_information')
+            symptom_analysis = state_values.get('symptom_analysis')
+            
+            response = WebResearchResponse(
+                status="success",
+                is_complete=True,
+                web_research_results=WebResearchResults(**web_research_info.model_dump()) if web_research_info else None,
+                extracted_data=symptom_analysis.model_dump() if symptom_analysis else {}
+            )
+            yield sse_event({'type': 'result', **response.model_dump()})
+
+        except Exception as e:
+            logger.error(f"Web research failed - Thread: {thread_id}, Error: {str(e)}", exc_info=True)
+            yield sse_event({'type': 'error', 'detail': f"Web research failed: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'Connection': 'keep-alive', 'X-Accel-Buffering': 'no'}
+    )
 
 
 
@@ -282,7 +322,7 @@ async def health_check():
     return {"status": "healthy", "service": "DiagnosticAI"}
 
 @app.get("/api/debug/state/{thread_id}")
-async def debug_state(thread_id: str):
+async def debug_state(thread_id: str, agent: AgentGraph = Depends(get_agent)):
     """Debug endpoint to inspect conversation state"""
     try:
         config = {'configurable': {'thread_id': thread_id}}
@@ -303,4 +343,17 @@ async def debug_state(thread_id: str):
                 "state_exists": False
             }
     except Exception as e:
-        return {"error": str(e), "thread_id": thread_id}
\ No newline at end of file
+        return {"error": str(e), "thread_id": thread_id}
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # "auto" picks uvloop and httptools when installed (not available on Windows)
+    uvicorn.run(
+        'app.app:app',
+        host=os.getenv('DIAGNOSTICAI_HOST', '127.0.0.1'),
+        port=int(os.getenv('DIAGNOSTICAI_PORT', '8000')),
+        loop='auto',
+        http='auto',
+        workers=int(os.getenv('DIAGNOSTICAI_WORKERS', '1'))
+    )
@@ -13,6 +13,7 @@ function App() {
   const [extractedData, setExtractedData] = useState({});
   const [showExtractedData, setShowExtractedData] = useState(false);
   const [webResearchResults, setWebResearchResults] = useState({}); // 🆕 NEW STATE
+  const [researchProgress, setResearchProgress] = useState('');
 
   const handleInputChange = (e) => {
     const value = e.target.value;
@@ -140,23 +141,32 @@ function App() {
     setIsLoading(true);
 
     try {
-      const response = await apiEndpoints.webResearch({
-        thread_id: threadId
+      let searchesCompleted = 0;
+
+      await apiEndpoints.webResearch({ thread_id: threadId }, (event) => {
+        if (event.type === 'tool_result') {
+          searchesCompleted += 1;
+          setResearchProgress(`Searches completed: ${searchesCompleted}`);
+        } else if (event.type === 'token') {
+          setResearchProgress('Writing analysis...');
+        } else if (event.type === 'result') {
+          console.log('Web research result:', event);
+
+          setConversationComplete(true);
+          setShowExtractedData(false);
+          setExtractedData(event.extracted_data);
+          setWebResearchResults(event.web_research_results || {});
+        } else if (event.type === 'error') {
+          throw new Error(event.detail);
+        }
       });
       
-      console.log('Web research result:', response.data);
-      
-      // 🔄 UPDATED - Store web research results
-      setConversationComplete(true);
-      setShowExtractedData(false);
-      setExtractedData(response.data.extracted_data);
-      setWebResearchResults(response.data.web_research_results || {}); // 🆕 NEW
-      
     } catch (error) {
       console.error('Error during web research:', error);
       alert('Web research failed. Please try again.');
     } finally {
       setIsLoading(false);
+      setResearchProgress('');
     }
   };
 
@@ -359,7 +369,7 @@ function App() {
           <svg className="submit-icon" fill="none" stroke="currentColor" viewBox="0 0 24 24">
             <path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M21 21l-6-6m2-5a7 7 0 11-14 0 7 7 0 0114 0z"></path>
           </svg>
-          <span>{isLoading ? 'Researching...' : 'Start Medical Research'}</span>
+          <span>{isLoading ? (researchProgress || 'Researching...') : 'Start Medical Research'}</span>
         </button>
       </div>
     );
@@ -41,9 +41,38 @@ export const apiEndpoints = {
     symptom: data.symptom
   }),
 
-  webResearch: (data) => api.post('/api/web-research', {
-    thread_id: data.thread_id
-  })
+  // The endpoint streams Server-Sent Events. EventSource only supports GET,
+  // so read the POST response body and call onEvent for every `data:` event.
+  webResearch: async (data, onEvent) => {
+    const response = await fetch(`${api.defaults.baseURL}/api/web-research`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ thread_id: data.thread_id })
+    });
+
+    if (!response.ok) {
+      throw new Error(`Web research failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+
+      for (const event of events) {
+        if (event.startsWith('data: ')) {
+          onEvent(JSON.parse(event.slice(6)));
+        }
+      }
+    }
+  }
 };
 
 export default api;
\ No newline at end of file